@@ -1,10 +1,30 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import folium
 from streamlit_folium import st_folium
 import osmnx as ox
-from shapely.geometry import Point
 import geopandas as gpd
+import shapely
+
+# Metrisches Koordinatensystem für Berlin (ETRS89 / UTM Zone 33N)
+METRIC_CRS = "EPSG:25833"
+
+# Lokaler Cache für das OSM-Straßennetz; Version erhöhen, um den Cache zu verwerfen
+OSM_CACHE_VERSION = 2
+OSM_NODES_PATH = Path(f"data/berlin_drive_nodes_v{OSM_CACHE_VERSION}.parquet")
+ox.settings.use_cache = True
+ox.settings.cache_folder = "data/osm_cache"
+
+# Lokale Kopie der Berliner Bezirksgrenzen
+BEZIRKE_PATH = Path("data/berlin_bezirke.parquet")
+
+# Ladesäulenregister und daraus vorberechnete Ladestationen mit Markierung "nahe Verkehrsknotenpunkt"
+LADESAEULEN_CSV_PATH = Path("data/Ladesaeulenregister_Berlin_01122024.csv")
+LADESAEULEN_CACHE_VERSION = 3
 
 # ---- Streamlit Konfiguration ----
 st.set_page_config(layout="wide")
@@ -19,41 +39,124 @@ logo = "data/ladestation.png"
 st.sidebar.image(logo)
 
 # ---- Daten einlesen ----
-@st.cache_data
+def ladesaeulen_cache_path():
+    # Cache-Datei an den Stand des Registers (Name, Größe, Änderungszeit) und des OSM-Caches koppeln
+    stat = LADESAEULEN_CSV_PATH.stat()
+    snapshot = f"{LADESAEULEN_CSV_PATH.stem}_{stat.st_size}_{stat.st_mtime_ns}"
+    return Path(f"data/{snapshot}_osm{OSM_CACHE_VERSION}_v{LADESAEULEN_CACHE_VERSION}.parquet")
+
 def load_data():
-    file_path = 'data/Ladesaeulenregister_Berlin_01122024.csv'
-    df = pd.read_csv(file_path, sep=';', encoding='utf-8')
-    
-    # Koordinaten korrigieren
-    df['Breitengrad'] = df['Breitengrad'].str.replace(',', '.').astype(float)
-    df['Längengrad'] = df['Längengrad'].str.replace(',', '.').astype(float)
+    # Wird nur beim Neuaufbau in build_ladesaeulen aufgerufen, daher ohne eigenen Cache
+    file_path = LADESAEULEN_CSV_PATH
+    # Nur die in der App genutzten Spalten einlesen; Dezimalkommas direkt beim Einlesen auflösen
+    columns = ['Betreiber', 'Nennleistung Ladeeinrichtung [kW]', 'Straße', 'Hausnummer', 'Breitengrad', 'Längengrad']
+    df = pd.read_csv(file_path, sep=';', encoding='utf-8', decimal=',', dtype_backend='pyarrow', usecols=columns)
+
+    # Fehlerhafte Einträge lassen eine Spalte als Text zurückfallen; dann ungültige Werte zu NaN machen
+    for col in ['Breitengrad', 'Längengrad', 'Nennleistung Ladeeinrichtung [kW]']:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+
+    # Häufig wiederkehrende Texte als Kategorien speichern
+    df = df.astype({'Betreiber': 'category', 'Straße': 'category'})
 
     # Nur vollständige Daten verwenden
     valid_df = df.dropna(subset=['Breitengrad', 'Längengrad'])
     return valid_df
 
-@st.cache_data
+@st.cache_resource
 def load_bezirke():
-    # Berliner Bezirksdaten aus GeoJSON laden
-    url = 'https://raw.githubusercontent.com/funkeinteraktiv/Berlin-Geodaten/master/berlin_bezirke.geojson'
-    gdf_bezirke = gpd.read_file(url)  # GeoJSON direkt als GeoDataFrame einlesen
+    # Lokale Parquet-Kopie der Bezirksdaten verwenden, falls vorhanden
+    if BEZIRKE_PATH.exists():
+        gdf_bezirke = gpd.read_parquet(BEZIRKE_PATH)
+    else:
+        # Berliner Bezirksdaten aus GeoJSON laden
+        url = 'https://raw.githubusercontent.com/funkeinteraktiv/Berlin-Geodaten/master/berlin_bezirke.geojson'
+        gdf_bezirke = gpd.read_file(url, engine='pyogrio')  # GeoJSON direkt als GeoDataFrame einlesen
+        gdf_bezirke.to_parquet(BEZIRKE_PATH)
+
+    # Polygone und räumlichen Index vorab aufbauen, damit die erste Bezirksauswahl schnell ist
+    gdf_bezirke = gdf_bezirke.to_crs(METRIC_CRS)
+    shapely.prepare(gdf_bezirke.geometry.values)
+    gdf_bezirke.sindex
     return gdf_bezirke
 
 @st.cache_data
 def load_osm_data():
+    # Zwischengespeichertes Straßennetzwerk verwenden, falls vorhanden
+    if OSM_NODES_PATH.exists():
+        return gpd.read_parquet(OSM_NODES_PATH)
+
     # Straßennetzwerk für Berlin von OpenStreetMap laden
     graph = ox.graph_from_place("Berlin, Germany", network_type="drive")
-    nodes, edges = ox.graph_to_gdfs(graph)
-    return nodes, edges
+    nodes = ox.graph_to_gdfs(graph, edges=False)  # Kanten werden nicht benötigt
+
+    # Nur echte Kreuzungen als Verkehrsknotenpunkte verwenden (keine Stützpunkte entlang einer Straße)
+    nodes = nodes[nodes['street_count'] >= 3]
+    nodes.to_parquet(OSM_NODES_PATH)
+    return nodes
+
+def filter_within(gdf, polygon):
+    # Bounding-Box-Vorauswahl über den räumlichen Index, danach exakter Test "Polygon enthält Geometrie"
+    idx = gdf.sindex.query(polygon, predicate="contains")
+    return gdf.iloc[np.sort(idx)]
+
+def flag_near_junction(gdf_ladesaeulen, nodes):
+    # Ladestationen im Umkreis von 500 m um einen Verkehrsknotenpunkt markieren
+    # Räumlicher Index statt Vereinigung aller Pufferzonen: liefert direkt die Paare (Ladestation, Knoten)
+    tree = nodes.sindex
+    geometries = gdf_ladesaeulen.geometry.values
+    chunks = np.array_split(np.arange(len(geometries)), os.cpu_count() or 1)
+
+    def query_chunk(idx):
+        idx_chunk, _ = tree.query(geometries[idx], predicate="dwithin", distance=500)
+        return idx[idx_chunk]
+
+    # Blöcke parallel abfragen; GEOS gibt während der Abfrage den GIL frei
+    near_junction = np.zeros(len(gdf_ladesaeulen), dtype=bool)
+    with ThreadPoolExecutor() as executor:
+        for idx_ladesaeulen in executor.map(query_chunk, chunks):
+            near_junction[idx_ladesaeulen] = True
+    return near_junction
+
+@st.cache_resource(max_entries=1)  # nur den aktuellen Registerstand im Speicher halten
+def build_ladesaeulen(cache_path):
+    # Vorberechnete Ladestationen inkl. Knotenpunkt-Markierung verwenden, falls vorhanden
+    if cache_path.exists():
+        gdf_ladesaeulen = gpd.read_parquet(cache_path)
+    else:
+        # GeoDataFrame für Ladestationen in einem Schritt erstellen; nur die Geometrie wird umprojiziert
+        # Abstände in Metern; die Kartenanzeige nutzt weiterhin Breiten-/Längengrad-Spalten
+        valid_df = load_data()
+        geometry = gpd.points_from_xy(valid_df['Längengrad'].to_numpy(), valid_df['Breitengrad'].to_numpy(), crs="EPSG:4326")
+        gdf_ladesaeulen = gpd.GeoDataFrame(valid_df, geometry=geometry.to_crs(METRIC_CRS))
+        nodes = load_osm_data().to_crs(METRIC_CRS)
+        gdf_ladesaeulen['near_junction'] = flag_near_junction(gdf_ladesaeulen, nodes)
+        gdf_ladesaeulen.to_parquet(cache_path)
+
+    gdf_ladesaeulen.sindex  # räumlichen Index vorab aufbauen
+    return gdf_ladesaeulen
+
+@st.cache_data
+def filter_ladesaeulen(selected_bezirk, filter_by_power, cache_path):
+    # Räumliche Auswertung nur bei geänderten Filtern oder neuem Register, nicht bei jeder Interaktion
+    gdf_ladesaeulen = build_ladesaeulen(cache_path)
+
+    # Filtere nach Bezirk, falls ausgewählt
+    if selected_bezirk != "Alle":
+        gdf_bezirke = load_bezirke()
+        bezirk_polygon = gdf_bezirke.loc[gdf_bezirke['name'] == selected_bezirk, 'geometry'].values[0]
+        gdf_ladesaeulen = filter_within(gdf_ladesaeulen, bezirk_polygon)
+
+    if filter_by_power:
+        gdf_ladesaeulen = gdf_ladesaeulen[gdf_ladesaeulen['Nennleistung Ladeeinrichtung [kW]'] > 50]
+
+    nearby_ladesaeulen = gdf_ladesaeulen[gdf_ladesaeulen['near_junction']]
+    return gdf_ladesaeulen, nearby_ladesaeulen
 
 # Daten laden
-valid_df = load_data()
 gdf_bezirke = load_bezirke()
-nodes, edges = load_osm_data()
-
-# ---- GeoDataFrame für Ladestationen erstellen ----
-valid_df['geometry'] = valid_df.apply(lambda x: Point(x['Längengrad'], x['Breitengrad']), axis=1)
-gdf_ladesaeulen = gpd.GeoDataFrame(valid_df, geometry='geometry', crs="EPSG:4326")
+ladesaeulen_path = ladesaeulen_cache_path()
 
 # ---- Streamlit App ----
 st.title("Analyse der Ladeinfrastruktur in Berlin")
@@ -86,22 +189,10 @@ selected_bezirk = st.selectbox(
     ["Alle"] + list(gdf_bezirke['name'].unique())
 )
 
-# Filtere nach Bezirk, falls ausgewählt
-if selected_bezirk != "Alle":
-    bezirk_polygon = gdf_bezirke.loc[gdf_bezirke['name'] == selected_bezirk, 'geometry'].values[0]
-    gdf_ladesaeulen = gdf_ladesaeulen[gdf_ladesaeulen.within(bezirk_polygon)]
-    nodes = nodes[nodes.within(bezirk_polygon)]
-    edges = edges[edges.within(bezirk_polygon)]
-
 # ---- Ladeleistungsfilter hinzufügen ----
 filter_by_power = st.checkbox("Nur Ladestationen mit mindestens 50 kW anzeigen", value=False)
 
-if filter_by_power:
-    gdf_ladesaeulen = gdf_ladesaeulen[gdf_ladesaeulen['Nennleistung Ladeeinrichtung [kW]'] > 50]
-
-# ---- Pufferzone um Verkehrsknotenpunkte erstellen ----
-buffer = nodes.buffer(0.005)  # 0.005° ≈ 500m
-nearby_ladesaeulen = gdf_ladesaeulen[gdf_ladesaeulen.intersects(buffer.unary_union)]
+gdf_ladesaeulen, nearby_ladesaeulen = filter_ladesaeulen(selected_bezirk, filter_by_power, ladesaeulen_path)
 
 # Multiselect-Optionen
 options = st.multiselect(
@@ -111,35 +202,33 @@ options = st.multiselect(
 )
 
 # ---- Karte erstellen ----
-map_berlin = folium.Map(location=[52.5200, 13.4050], zoom_start=11)
+map_berlin = folium.Map(location=[52.5200, 13.4050], zoom_start=11, prefer_canvas=True)
 
-# Bestehende Ladestationen (blau)
+# Bestehende Ladestationen (blau), als eine GeoJSON-Ebene mit Kreismarkern auf dem Canvas
 if "Bestehende Ladestationen" in options:
-    for _, row in gdf_ladesaeulen.iterrows():
-        folium.Marker(
-            location=[row['Breitengrad'], row['Längengrad']],
-            popup=(
-                f"Betreiber: {row['Betreiber']}<br>"
-                f"Leistung: {row['Nennleistung Ladeeinrichtung [kW]']} kW<br>"
-                f"Adresse: {row['Straße']} {row['Hausnummer']}"
-            ),
-            icon=folium.Icon(color="blue", icon="bolt", prefix="fa")
-        ).add_to(map_berlin)
-
-# Neue berechnete Ladestationen in der Nähe von Verkehrsknotenpunkten (rot)
+    layer_bestehend = folium.FeatureGroup(name="Bestehende Ladestationen")
+    folium.GeoJson(
+        gdf_ladesaeulen[['Betreiber', 'Nennleistung Ladeeinrichtung [kW]', 'Straße', 'Hausnummer', 'geometry']],
+        marker=folium.CircleMarker(radius=4, color="blue", fill=True, fill_opacity=0.8),
+        popup=folium.GeoJsonPopup(
+            fields=['Betreiber', 'Nennleistung Ladeeinrichtung [kW]', 'Straße', 'Hausnummer'],
+            aliases=["Betreiber:", "Leistung (kW):", "Straße:", "Hausnummer:"],
+        ),
+    ).add_to(layer_bestehend)
+    layer_bestehend.add_to(map_berlin)
+
+# Neue berechnete Ladestationen in der Nähe von Verkehrsknotenpunkten (rot), als eine GeoJSON-Ebene
 if "Neue berechnete Ladestationen (Verkehrsknotenpunkte)" in options:
-    for _, row in nearby_ladesaeulen.iterrows():
-        folium.CircleMarker(
-            location=[row['Breitengrad'], row['Längengrad']],
-            radius=6,
-            color="red",
-            fill=True,
-            fill_opacity=0.8,
-            popup=f"Neue Station in Nähe zu Verkehrsknoten: {row['Straße']}"
-        ).add_to(map_berlin)
-
-# Karte anzeigen
-st_folium(map_berlin, width=1800, height=1000)
+    layer_neu = folium.FeatureGroup(name="Neue berechnete Ladestationen")
+    folium.GeoJson(
+        nearby_ladesaeulen[['Straße', 'geometry']],  # wird von folium nach EPSG:4326 umprojiziert
+        marker=folium.CircleMarker(radius=6, color="red", fill=True, fill_opacity=0.8),
+        popup=folium.GeoJsonPopup(fields=['Straße'], aliases=["Neue Station in Nähe zu Verkehrsknoten:"]),
+    ).add_to(layer_neu)
+    layer_neu.add_to(map_berlin)
+
+# Karte anzeigen; keine Kartenzustände zurückgeben, damit Zoomen/Verschieben keinen Rerun auslöst
+st_folium(map_berlin, width=1800, height=1000, returned_objects=[])
 
 # ---- Analyseergebnisse ----
 st.subheader("Analyseergebnisse")
@@ -1,4 +1,5 @@
 import pypsa
+from pathlib import Path
 import pandas as pd
 import matplotlib.pyplot as plt
 import streamlit as st
@@ -7,6 +8,8 @@ import plotly.graph_objects as go
 
 plt.style.use("bmh")
 
+TIMESERIES_PATH = Path("data/time-series-lecture-2.parquet")
+
 st.title("Decarbonizing Germany’s Electricity Supply: A Capacity Expansion Planning Model with PyPSA")
 
 st.markdown("""
@@ -73,37 +76,53 @@ This model uses:
 - **Electricity Demand and Renewable Generation Time Series (Germany 2015)**
 """)
 
-# Load and Visualize Data
-year = 2030
-url = f"https://raw.githubusercontent.com/PyPSA/technology-data/master/outputs/costs_{year}.csv"
-costs = pd.read_csv(url, index_col=[0, 1])
-
-costs.loc[costs.unit.str.contains("/kW"), "value"] *= 1e3
-costs.unit = costs.unit.str.replace("/kW", "/MW")
-
-defaults = {
-    "FOM": 0,
-    "VOM": 0,
-    "efficiency": 1,
-    "fuel": 0,
-    "investment": 0,
-    "lifetime": 25,
-    "CO2 intensity": 0,
-    "discount rate": 0.07,
-}
-costs = costs.value.unstack().fillna(defaults)
-
-costs.at["OCGT", "fuel"] = costs.at["gas", "fuel"]
-costs.at["CCGT", "fuel"] = costs.at["gas", "fuel"]
-costs.at["OCGT", "CO2 intensity"] = costs.at["gas", "CO2 intensity"]
-costs.at["CCGT", "CO2 intensity"] = costs.at["gas", "CO2 intensity"]
-
 def annuity(r, n):
     return r / (1.0 - 1.0 / (1.0 + r) ** n)
 
-costs["marginal_cost"] = costs["VOM"] + costs["fuel"] / costs["efficiency"]
-annuity_values = costs.apply(lambda x: annuity(x["discount rate"], x["lifetime"]), axis=1)
-costs["capital_cost"] = (annuity_values + costs["FOM"] / 100) * costs["investment"]
+@st.cache_data(ttl=86400)
+def load_costs(year):
+    url = f"https://raw.githubusercontent.com/PyPSA/technology-data/master/outputs/costs_{year}.csv"
+    costs = pd.read_csv(url, index_col=[0, 1])
+
+    costs.loc[costs.unit.str.contains("/kW"), "value"] *= 1e3
+    costs.unit = costs.unit.str.replace("/kW", "/MW")
+
+    defaults = {
+        "FOM": 0,
+        "VOM": 0,
+        "efficiency": 1,
+        "fuel": 0,
+        "investment": 0,
+        "lifetime": 25,
+        "CO2 intensity": 0,
+        "discount rate": 0.07,
+    }
+    costs = costs.value.unstack().fillna(defaults)
+
+    costs.at["OCGT", "fuel"] = costs.at["gas", "fuel"]
+    costs.at["CCGT", "fuel"] = costs.at["gas", "fuel"]
+    costs.at["OCGT", "CO2 intensity"] = costs.at["gas", "CO2 intensity"]
+    costs.at["CCGT", "CO2 intensity"] = costs.at["gas", "CO2 intensity"]
+
+    costs["marginal_cost"] = costs["VOM"] + costs["fuel"] / costs["efficiency"]
+    annuity_values = annuity(costs["discount rate"], costs["lifetime"])
+    costs["capital_cost"] = (annuity_values + costs["FOM"] / 100) * costs["investment"]
+    return costs
+
+@st.cache_data
+def load_timeseries():
+    # Local Parquet copy avoids the download and CSV parse on later runs
+    if TIMESERIES_PATH.exists():
+        return pd.read_parquet(TIMESERIES_PATH)
+
+    url = "https://tubcloud.tu-berlin.de/s/pKttFadrbTKSJKF/download/time-series-lecture-2.csv"
+    ts = pd.read_csv(url, index_col=0, parse_dates=True)
+    ts.to_parquet(TIMESERIES_PATH)
+    return ts
+
+# Load and Visualize Data
+year = 2030
+costs = load_costs(year)
 
 # Filter only selected technologies and remove rows with NaN values
 selected_techs = ["onwind", "offwind", "solar", "OCGT", "hydrogen storage underground", "battery storage", "battery inverter", "electrolysis", "fuel cell"]
@@ -120,11 +139,10 @@ if not costs.empty:
     st.write(costs.dropna(how='all', axis=0).dropna(how='all', axis=1))
 
 # Load Time-Series Data
-url = "https://tubcloud.tu-berlin.de/s/pKttFadrbTKSJKF/download/time-series-lecture-2.csv"
-ts = pd.read_csv(url, index_col=0, parse_dates=True)
+ts = load_timeseries()
 ts.load *= 1e3  # Convert load to MW
 resolution = 4
-ts = ts.resample(f"{resolution}h").first()
+ts = ts.astype("float32").resample(f"{resolution}h").mean()  # Window mean is the energy-consistent value for a snapshot weighted by `resolution` hours
 
 # Show Demand Time-Series
 st.subheader("Electricity Demand Time Series")
@@ -144,46 +162,61 @@ fig = px.line(ts_melted, x="index", y="Capacity Factor", color="Technology",
 fig.update_layout(xaxis_title="Time", yaxis_title="Capacity Factor", height=400)
 st.plotly_chart(fig, use_container_width=True)
 
-# Initialize Network
-n = pypsa.Network()
-n.add("Bus", "electricity")
-n.set_snapshots(ts.index)
-n.snapshot_weightings.loc[:, :] = resolution
-
-# Add Technologies
-n.add("Carrier", selected_techs, co2_emissions=[costs.at[c, "CO2 intensity"] for c in selected_techs])
-
-# Add Loads
-n.add("Load", "demand", bus="electricity", p_set=ts.load)
-
-# Add Generators
-for tech in selected_techs[:3]:  # Only onwind, offwind, solar
-    n.add("Generator", tech, bus="electricity", carrier=tech, p_max_pu=ts[tech],
-          capital_cost=costs.at[tech, "capital_cost"], marginal_cost=costs.at[tech, "marginal_cost"],
-          efficiency=costs.at[tech, "efficiency"], p_nom_extendable=True)
-
-n.add("Generator", "OCGT", bus="electricity", carrier="OCGT",
-      capital_cost=costs.at["OCGT", "capital_cost"], marginal_cost=costs.at["OCGT", "marginal_cost"],
-      efficiency=costs.at["OCGT", "efficiency"], p_nom_extendable=True)
-
-# Add Storage Units with energy-to-power ratio of 6 h
-n.add("StorageUnit", "battery storage", bus="electricity", carrier="battery storage",
-      max_hours=6, capital_cost=costs.at["battery inverter", "capital_cost"] + 6 * costs.at["battery storage", "capital_cost"],
-      efficiency_store=costs.at["battery inverter", "efficiency"], efficiency_dispatch=costs.at["battery inverter", "efficiency"],
-      p_nom_extendable=True, cyclic_state_of_charge=True)
-
-# Add Hydrogen Storage with energy-to-power ratio of 168 h 
-capital_costs = (costs.at["electrolysis", "capital_cost"] + costs.at["fuel cell", "capital_cost"] + 168 * costs.at["hydrogen storage underground", "capital_cost"])
-n.add("StorageUnit", "hydrogen storage underground", bus="electricity", carrier="hydrogen storage underground",
-      max_hours=168, capital_cost=capital_costs,
-      efficiency_store=costs.at["electrolysis", "efficiency"], efficiency_dispatch=costs.at["fuel cell", "efficiency"],
-      p_nom_extendable=True, cyclic_state_of_charge=True)
-    
+def build_network(costs, ts, resolution):
+    # Initialize Network
+    n = pypsa.Network()
+    n.add("Bus", "electricity")
+    n.set_snapshots(ts.index)
+    n.snapshot_weightings.loc[:, :] = resolution
+
+    # Add Technologies
+    n.add("Carrier", selected_techs, co2_emissions=[costs.at[c, "CO2 intensity"] for c in selected_techs])
+
+    # Add Loads
+    n.add("Load", "demand", bus="electricity", p_set=ts.load)
+
+    # Add Generators
+    for tech in selected_techs[:3]:  # Only onwind, offwind, solar
+        n.add("Generator", tech, bus="electricity", carrier=tech, p_max_pu=ts[tech],
+              capital_cost=costs.at[tech, "capital_cost"], marginal_cost=costs.at[tech, "marginal_cost"],
+              efficiency=costs.at[tech, "efficiency"], p_nom_extendable=True)
+
+    n.add("Generator", "OCGT", bus="electricity", carrier="OCGT",
+          capital_cost=costs.at["OCGT", "capital_cost"], marginal_cost=costs.at["OCGT", "marginal_cost"],
+          efficiency=costs.at["OCGT", "efficiency"], p_nom_extendable=True)
+
+    # Add Storage Units with energy-to-power ratio of 6 h
+    n.add("StorageUnit", "battery storage", bus="electricity", carrier="battery storage",
+          max_hours=6, capital_cost=costs.at["battery inverter", "capital_cost"] + 6 * costs.at["battery storage", "capital_cost"],
+          efficiency_store=costs.at["battery inverter", "efficiency"], efficiency_dispatch=costs.at["battery inverter", "efficiency"],
+          p_nom_extendable=True, cyclic_state_of_charge=True)
+
+    # Add Hydrogen Storage with energy-to-power ratio of 168 h 
+    capital_costs = (costs.at["electrolysis", "capital_cost"] + costs.at["fuel cell", "capital_cost"] + 168 * costs.at["hydrogen storage underground", "capital_cost"])
+    n.add("StorageUnit", "hydrogen storage underground", bus="electricity", carrier="hydrogen storage underground",
+          max_hours=168, capital_cost=capital_costs,
+          efficiency_store=costs.at["electrolysis", "efficiency"], efficiency_dispatch=costs.at["fuel cell", "efficiency"],
+          p_nom_extendable=True, cyclic_state_of_charge=True)
+    return n
+
+# Bounded so that the sensitivity sweep plus the current slider value fit, without keeping every solved model
+@st.cache_resource(ttl=86400, max_entries=8)
+def solve_network(co2_limit, year, resolution, costs, ts):
+    # Costs and time series are part of the key, so refreshed cost data triggers a new solve
+    n = build_network(costs, ts, resolution)
+    n.add("GlobalConstraint", "CO2Limit", carrier_attribute="co2_emissions", sense="<=", constant=co2_limit)
+    n.optimize(solver_name="highs")
+    return n
+
+def system_cost(n):
+    tsc = pd.concat([n.statistics.capex(), n.statistics.opex()], axis=1)
+    return tsc.sum(axis=1).droplevel(0).div(1e9).round(2)  # billion €/a
+
 # Optimize Model
 st.sidebar.subheader("Run Optimization")
 if st.sidebar.button("Optimize System"):
-    n.add("GlobalConstraint", "CO2Limit", carrier_attribute="co2_emissions", sense="<=", constant=co2_limit)
-    n.optimize(solver_name="highs")
+    # Solved networks are shared from the cache and must not be modified
+    n = solve_network(co2_limit, year, resolution, costs, ts)
 
     # Show Optimization Results
     st.header("Optimized Generator Capacities (MW)")
@@ -193,10 +226,6 @@ if st.sidebar.button("Optimize System"):
     st.write(n.storage_units.p_nom_opt * n.storage_units.max_hours / 1e3)
 
     # Show System Cost Breakdown with Stackable Bar Chart
-    def system_cost(n):
-        tsc = pd.concat([n.statistics.capex(), n.statistics.opex()], axis=1)
-        return tsc.sum(axis=1).droplevel(0).div(1e9).round(2)  # billion €/a
-    
     st.subheader("System Cost Breakdown (in billion €/a)")
     cost_df = system_cost(n)
 
@@ -283,11 +312,8 @@ if st.sidebar.button("Optimize System"):
     # Sensitivity Analysis
     sensitivity = {}
     for co2 in all_co2_values:
-        n.global_constraints.loc["CO2Limit", "constant"] = co2 * 1e6
-        n.optimize(solver_name="highs")
-        
-        # Compute system cost
-        system_costs = system_cost(n)
+        # Each CO₂ limit is solved once and then served from the cache
+        system_costs = system_cost(solve_network(co2 * 1e6, year, resolution, costs, ts))
         
         # Ensure only technologies present in system_costs are selected
         valid_techs = [tech for tech in optimized_technologies if tech in system_costs.index]